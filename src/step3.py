@@ -1,6 +1,7 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import warnings
 
 # chemin vers le fichier CSV mergé generé à l'étape précédente
 MERGED_FILE = '../out/merged.csv'
@@ -11,6 +12,9 @@ ACTIVITIES_FILE = '../resources/activites.xlsx'
 # chemin de sortie pour le fichier CSV labelisé
 OUT_FILE = '../out/data.csv'
 
+# chemin de sortie pour la banque de signatures du classifieur DTW
+TEMPLATES_FILE = '../out/templates.npz'
+
 def skip_rows(index,nth):
     """
     Fonction utilisée pour sauter des lignes lors de la lecture du fichier CSV
@@ -93,6 +97,27 @@ def get_segmented_activities(activities, data):
 
 
 
+def resample_segment(df, target_length):
+    """
+    Fonction permettant de ré-échantillonner un segment de données sur une longueur cible par interpolation linéaire
+    :param df: DataFrame contenant le segment de données
+    :param target_length: longueur cible du segment
+    :return: DataFrame contenant le segment interpolé, indexé entre 0 et 1
+    """
+    # on précise les indices pour la nouvelle longueur cible
+    new_index = np.linspace(0, 1, target_length)
+    interp_func = np.linspace(0, 1, df.shape[0])
+    interpolated_arrays = []
+
+    # Interpoler chaque colonne du DataFrame
+    for col in df.columns:
+        interp_series = np.interp(new_index, interp_func, df[col])
+        interpolated_arrays.append(interp_series)
+
+    # Créer un nouveau DataFrame avec les données interpolées
+    return pd.DataFrame(np.column_stack(interpolated_arrays), index=new_index, columns=df.columns)
+
+
 def get_average_signature(activity_segments, target_length):
     """
     Fonction permettant de calculer la signature moyenne pour chaque activité
@@ -103,27 +128,10 @@ def get_average_signature(activity_segments, target_length):
     # Dictionnaire pour stocker les données normalisées
     activity_average_signatures = {}
 
-    # on précise les indices pour la nouvelle longueur cible de la signature moyenne
-    new_index = np.linspace(0, 1, target_length)
-
     # on parcourt les activités
     for activity, data in activity_segments.items():
         # Liste pour stocker les données interpolées
-        resampled_data = []
-
-        # on parcourt les segments de données pour cette activité
-        for df in data['data']:
-            interp_func = np.linspace(0, 1, df.shape[0])
-            interpolated_arrays = []
-
-            # Interpoler chaque colonne du DataFrame
-            for col in df.columns:
-                interp_series = np.interp(new_index, interp_func, df[col])
-                interpolated_arrays.append(interp_series)
-
-            # Créer un nouveau DataFrame avec les données interpolées
-            interpolated_df = pd.DataFrame(np.column_stack(interpolated_arrays), index=new_index, columns=df.columns)
-            resampled_data.append(interpolated_df)
+        resampled_data = [resample_segment(df, target_length) for df in data['data']]
 
         # On concatène les données interpolées et on calcule la moyenne
         mean_df = pd.concat(resampled_data).groupby(level=0).mean()
@@ -132,6 +140,226 @@ def get_average_signature(activity_segments, target_length):
     return activity_average_signatures
 
 
+def get_envelopes(templates, window):
+    """
+    Fonction permettant de calculer les enveloppes haute et basse (LB_Keogh) des signatures
+    :param templates: tableau numpy de forme (activités, longueur, capteurs) contenant les signatures
+    :param window: taille de la fenêtre de déformation (en nombre d'échantillons)
+    :return: tuple (enveloppe haute, enveloppe basse), de même forme que templates
+    """
+    # on répète les valeurs des bords pour que la fenêtre soit tronquée aux extrémités
+    padded = np.pad(templates, ((0, 0), (window, window), (0, 0)), mode='edge')
+    # fenêtres glissantes de taille 2 * window + 1 centrées sur chaque échantillon
+    windows = np.lib.stride_tricks.sliding_window_view(padded, 2 * window + 1, axis=1)
+    return windows.max(axis=-1), windows.min(axis=-1)
+
+
+def lb_keogh(query, upper, lower):
+    """
+    Fonction permettant de calculer la borne inférieure LB_Keogh entre une requête et toutes les signatures à la fois
+    :param query: tableau numpy de forme (longueur, capteurs)
+    :param upper: enveloppes hautes des signatures, de forme (activités, longueur, capteurs)
+    :param lower: enveloppes basses des signatures, de forme (activités, longueur, capteurs)
+    :return: tableau numpy contenant la borne inférieure pour chaque signature
+    """
+    # on ne compte que la partie de la requête qui sort de l'enveloppe
+    excess = np.maximum(query - upper, 0) + np.maximum(lower - query, 0)
+    return (excess ** 2).sum(axis=(1, 2))
+
+
+def dtw_distance(a, b, window, best_so_far=np.inf):
+    """
+    Fonction permettant de calculer la distance DTW (somme des carrés) entre deux séries multivariées,
+    avec une contrainte de fenêtre de Sakoe-Chiba et un abandon anticipé
+    :param a: tableau numpy de forme (longueur, capteurs)
+    :param b: tableau numpy de forme (longueur, capteurs)
+    :param window: taille de la fenêtre de déformation (en nombre d'échantillons)
+    :param best_so_far: meilleure distance connue, le calcul est abandonné dès qu'elle est dépassée
+    :return: la distance DTW, ou np.inf si le calcul a été abandonné
+    """
+    n, m = len(a), len(b)
+    # la fenêtre doit au moins couvrir la différence de longueur pour atteindre la dernière case
+    window = max(window, abs(n - m))
+
+    previous = np.full(m + 1, np.inf)
+    previous[0] = 0
+    for i in range(1, n + 1):
+        current = np.full(m + 1, np.inf)
+        start = max(1, i - window)
+        end = min(m, i + window)
+
+        # coûts locaux calculés d'un coup sur toute la bande
+        costs = ((a[i - 1] - b[start - 1:end]) ** 2).sum(axis=1)
+        for j in range(start, end + 1):
+            current[j] = costs[j - start] + min(previous[j - 1], previous[j], current[j - 1])
+
+        # si toute la ligne dépasse déjà la meilleure distance, le chemin ne pourra pas faire mieux
+        if current[start:end + 1].min() > best_so_far:
+            return np.inf
+        previous = current
+
+    return previous[m]
+
+
+class TemplateClassifier:
+    """
+    Classifieur par plus proche signature moyenne au sens de la distance DTW.
+    Les signatures sont élaguées avec la borne LB_Keogh avant de calculer la distance DTW complète.
+    """
+    def __init__(self, activity_average_signatures=None, window=10):
+        """
+        Initialise le classifieur et construit la banque de signatures si elles sont fournies.
+        :param activity_average_signatures: dictionnaire contenant les signatures moyennes pour chaque activité
+        :param window: taille de la fenêtre de déformation (en nombre d'échantillons)
+        """
+        self.window = window
+        if activity_average_signatures is not None:
+            self.fit(activity_average_signatures)
+
+    def fit(self, activity_average_signatures):
+        """
+        Construit la banque de signatures : normalisation des capteurs et calcul des enveloppes.
+        :param activity_average_signatures: dictionnaire contenant les signatures moyennes pour chaque activité
+        :return: le classifieur
+        """
+        self.classes = [str(activity) for activity in activity_average_signatures.keys()]
+        self.columns = [str(col) for col in next(iter(activity_average_signatures.values())).columns]
+        templates = np.stack([signature[self.columns].to_numpy(dtype=float)
+                              for signature in activity_average_signatures.values()])
+
+        # moyenne et écart-type de chaque capteur sur toutes les signatures, pour les ramener à la même échelle
+        # (les capteurs sans aucune valeur donnent NaN, remplacé ensuite par 0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            self.mean = np.nan_to_num(np.nanmean(templates, axis=(0, 1)))
+            std = np.nan_to_num(np.nanstd(templates, axis=(0, 1)))
+        self.std = np.where(std > 0, std, 1.0)
+
+        self.templates = self._normalize(templates)
+        self.upper, self.lower = get_envelopes(self.templates, self.window)
+        return self
+
+    def _normalize(self, values):
+        """
+        Normalise les valeurs des capteurs, les valeurs manquantes sont remplacées par la moyenne.
+        :param values: tableau numpy dont la dernière dimension correspond aux capteurs
+        :return: le tableau normalisé
+        """
+        return np.nan_to_num((values - self.mean) / self.std)
+
+    def _prepare(self, segment):
+        """
+        Ré-échantillonne et normalise un segment pour le comparer aux signatures.
+        :param segment: DataFrame contenant le segment de données
+        :return: tableau numpy de forme (longueur, capteurs)
+        :raises ValueError: si le segment ne contient aucune ligne
+        """
+        # un segment vide ne peut pas être interpolé
+        if len(segment) == 0:
+            raise ValueError("Le segment à classifier est vide")
+
+        resampled = resample_segment(segment[self.columns], self.templates.shape[1])
+        return self._normalize(resampled.to_numpy(dtype=float))
+
+    def predict_one(self, segment):
+        """
+        Prédit l'activité d'un segment.
+        :param segment: DataFrame contenant le segment de données
+        :return: un tuple contenant l'activité prédite et sa distance DTW
+        :raises ValueError: si le segment ne contient aucune ligne
+        """
+        query = self._prepare(segment)
+        lower_bounds = lb_keogh(query, self.upper, self.lower)
+
+        best_index, best_distance = None, np.inf
+        # on parcourt les signatures par borne inférieure croissante
+        for index in np.argsort(lower_bounds):
+            # les bornes suivantes sont plus grandes, aucune signature restante ne peut faire mieux
+            if lower_bounds[index] >= best_distance:
+                break
+            distance = dtw_distance(query, self.templates[index], self.window, best_distance)
+            if distance < best_distance:
+                best_index, best_distance = index, distance
+
+        return self.classes[best_index], best_distance
+
+    def predict(self, segments):
+        """
+        Prédit l'activité de chaque segment.
+        :param segments: liste de DataFrame contenant les segments de données
+        :return: liste des activités prédites
+        :raises ValueError: si l'un des segments ne contient aucune ligne
+        """
+        return [self.predict_one(segment)[0] for segment in segments]
+
+    def save(self, path):
+        """
+        Sauvegarde la banque de signatures dans un fichier .npz.
+        :param path: chemin du fichier de sortie
+        """
+        np.savez(path, classes=np.array(self.classes), columns=np.array(self.columns), window=self.window,
+                 mean=self.mean, std=self.std, templates=self.templates, upper=self.upper, lower=self.lower)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Charge une banque de signatures sauvegardée avec save.
+        :param path: chemin du fichier .npz
+        :return: le classifieur chargé
+        """
+        # on copie les tableaux hors du fichier avant qu'il ne soit fermé
+        with np.load(path) as bank:
+            classifier = cls(window=int(bank['window']))
+            classifier.classes = bank['classes'].tolist()
+            classifier.columns = bank['columns'].tolist()
+            classifier.mean = bank['mean']
+            classifier.std = bank['std']
+            classifier.templates = bank['templates']
+            classifier.upper = bank['upper']
+            classifier.lower = bank['lower']
+        return classifier
+
+
+
+
+def evaluate_template_classifier(activity_segments, target_length, window):
+    """
+    Fonction permettant d'évaluer le classifieur par signature moyenne en validation croisée "leave-one-segment-out" :
+    chaque segment est prédit par un classifieur dont les signatures ont été calculées sans lui
+    :param activity_segments: dictionnaire contenant les segments de données pour chaque activité
+    :param target_length: longueur cible pour les signatures moyennes
+    :param window: taille de la fenêtre de déformation (en nombre d'échantillons)
+    :return: la précision du classifieur (en pourcentage) sur les segments mis de côté
+    :raises ValueError: si aucune activité n'a au moins deux segments non vides
+    """
+    # on ignore les segments vides, qui ne peuvent être ni moyennés ni classifiés
+    segments = {activity: [df for df in data['data'] if len(df) > 0] for activity, data in activity_segments.items()}
+
+    correct = 0
+    total = 0
+    # on parcourt les activités
+    for activity, activity_data in segments.items():
+        # une activité avec un seul segment n'aurait plus de signature une fois ce segment mis de côté
+        if len(activity_data) < 2:
+            continue
+
+        for index, held_out in enumerate(activity_data):
+            # on calcule les signatures sans le segment à prédire
+            train_segments = {}
+            for other_activity, other_data in segments.items():
+                if other_activity == activity:
+                    other_data = activity_data[:index] + activity_data[index + 1:]
+                if other_data:
+                    train_segments[other_activity] = {'data': other_data}
+
+            classifier = TemplateClassifier(get_average_signature(train_segments, target_length), window=window)
+            correct += classifier.predict_one(held_out)[0] == str(activity)
+            total += 1
+
+    if total == 0:
+        raise ValueError("Aucune activité n'a au moins deux segments non vides à évaluer")
+
+    return 100 * correct / total
 
 
 def plot_activity_data_in_one_figure(activity_average_signatures, target_length):
@@ -174,33 +402,44 @@ def plot_activity_data_in_one_figure(activity_average_signatures, target_length)
     plt.show()
 
 
-# on récupère les données des capteurs
-data = get_data()
+if __name__ == '__main__':
+    # on récupère les données des capteurs
+    data = get_data()
+
+    # on récupère les données des activités
+    activities = get_activities()
+
+    # on segmente les données en fonction des dates des activités
+    segmented = get_segmented_activities(activities, data)
 
-# on récupère les données des activités
-activities = get_activities()
 
-# on segmente les données en fonction des dates des activités
-segmented = get_segmented_activities(activities, data)
+    # on calcule la signature moyenne pour chaque activité
+    target_length = 100
+    activity_average_signatures = get_average_signature(segmented, target_length)
+    # on affiche les signatures moyennes pour chaque activité sous forme de graphiques
+    plot_activity_data_in_one_figure(activity_average_signatures, target_length)
 
+    # fenêtre de déformation de 10% de la longueur des signatures
+    window = max(1, target_length // 10)
 
-# on calcule la signature moyenne pour chaque activité
-target_length = 100
-activity_average_signatures = get_average_signature(segmented, target_length)
-# on affiche les signatures moyennes pour chaque activité sous forme de graphiques
-plot_activity_data_in_one_figure(activity_average_signatures, target_length)
+    # on construit le classifieur par signature moyenne et on sauvegarde la banque de signatures
+    classifier = TemplateClassifier(activity_average_signatures, window=window)
+    classifier.save(TEMPLATES_FILE)
 
-# on ajoute une colonne label au données en fonction de l'activité
-all_data_frames = []
-for activity_name, info in segmented.items():
-    for df in info['data']:
-        df['label'] = activity_name
-        all_data_frames.append(df)
+    # on évalue le classifieur sur des segments qui n'ont pas servi à calculer les signatures
+    accuracy = evaluate_template_classifier(segmented, target_length, window)
+    print('Test Accuracy of the template classifier on the held-out segments: {:.2f} %'.format(accuracy))
 
-# on regroupe tous les segments dans un dataframe
-final_df = pd.concat(all_data_frames)
-final_df.reset_index(drop=True, inplace=True)
+    # on ajoute une colonne label au données en fonction de l'activité
+    all_data_frames = []
+    for activity_name, info in segmented.items():
+        for df in info['data']:
+            df['label'] = activity_name
+            all_data_frames.append(df)
 
-# on exporte ce nouveau dataframe
-final_df.to_csv(OUT_FILE, index=False)
+    # on regroupe tous les segments dans un dataframe
+    final_df = pd.concat(all_data_frames)
+    final_df.reset_index(drop=True, inplace=True)
 
+    # on exporte ce nouveau dataframe
+    final_df.to_csv(OUT_FILE, index=False)